@@ -1,116 +1,204 @@
+import functools
+import gzip
+import itertools
 import json
+import math
+from operator import contains, eq, ge, gt, le, lt, ne, not_
 import os
-from typing import Dict, Any, List, Optional, Union
-import uuid
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
 from datetime import datetime
 import re
+import threading
+import time
 import urllib.request
 
-class JsonDB:
-    def __init__(self, filename: str):
-        self.filename = filename
-        self.data = {}
-        self._load_db()
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
 
-    def _load_db(self) -> None:
-        """Load data from JSON file (local or URL) if it exists, otherwise initialize empty data."""
-        if self.filename.startswith('http://') or self.filename.startswith('https://'):
-            try:
-                with urllib.request.urlopen(self.filename) as response:
-                    data = response.read().decode('utf-8')
-                    self.data = json.loads(data)
-            except urllib.error.URLError as e:
-                raise IOError(f"Failed to fetch from URL: {e.reason}")
-            except json.JSONDecodeError:
-                raise ValueError("Failed to decode JSON from URL.")
-        elif os.path.exists(self.filename):
+# commit() folds the write-ahead log back into a fresh snapshot once the log
+# is larger than the snapshot itself, so the cost of rewriting the snapshot
+# is spread over at least as many bytes of logged mutations. Small databases
+# are allowed a log of this many bytes before compacting.
+_WAL_COMPACT_MIN_BYTES = 1024 * 1024
+
+# Pending log entries are written out early once the buffer reaches this size.
+_WAL_BUFFER_SIZE = 128 * 1024
+
+# Record IDs count up from the import time in milliseconds, shifted to leave
+# room for about a million IDs per millisecond. The counter is shared by every
+# JsonDB in the process, so databases reopened within the same millisecond
+# never hand out the same ID twice.
+_next_id = itertools.count(int(time.time() * 1000) << 20)
+
+
+# orjson reads integers wider than 64 bits as floats, silently losing
+# precision. Any such integer has at least 20 digits, so text containing a
+# run that long is left to the json module.
+_LONG_DIGITS = re.compile(r"\d{20}")
+_LONG_DIGITS_BYTES = re.compile(rb"\d{20}")
+
+
+def _has_non_finite(obj: Any) -> bool:
+    """Return whether a decoded JSON value contains NaN or an infinite float."""
+    pending = [obj]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+    return False
+
+
+def _dumps(obj: Any, indent: bool = False) -> bytes:
+    """Serialize to JSON bytes, using orjson when it is installed.
+
+    Output is compact unless ``indent`` is set. orjson only supports
+    two-space indentation; the standard library fallback uses four.
+    Values orjson would write differently from the json module are left to
+    the json module, so both produce the same data.
+    """
+    if orjson is not None:
+        # Types json cannot encode (datetimes, dataclasses, subclasses it
+        # would treat differently) make orjson raise instead of converting them.
+        option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS)
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            payload = orjson.dumps(obj, option=option)
+        except TypeError:
+            payload = None  # E.g. an integer beyond 64 bits; json either encodes it or raises
+        # orjson writes NaN and infinities as null where json keeps them
+        if payload is not None and (b"null" not in payload or not _has_non_finite(obj)):
+            return payload
+    if indent:
+        return json.dumps(obj, indent=4).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data: Union[bytes, str]) -> Any:
+    """Deserialize JSON bytes or text, using orjson when it can read it exactly."""
+    if orjson is not None:
+        long_digits = _LONG_DIGITS if isinstance(data, str) else _LONG_DIGITS_BYTES
+        if long_digits.search(data) is None:
             try:
-                with open(self.filename, 'r') as f:
-                    self.data = json.load(f)
-            except json.JSONDecodeError:
-                self.data = {}
-        else:
-            self.data = {}
-            # If it's a new local file, save it to ensure it exists.
-            # No need to save if it's a URL, as it's not a persistent local file.
-            if not (self.filename.startswith('http://') or self.filename.startswith('https://')):
-                self._save_db()
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass  # E.g. NaN or Infinity, which the json module writes and reads
+    return json.loads(data)
 
-    def _save_db(self) -> None:
-        """Save data to JSON file."""
-        with open(self.filename, 'w') as f:
-            json.dump(self.data, f, indent=4)
 
-    def create_record_id(self):
-        return str(uuid.uuid4())
+# Opcodes emitted by _compile_criteria. A compiled program is a list of
+# tuples whose first element is one of these; operands follow the opcode.
+OP_LOAD_FIELD = 0
+OP_CONST = 1
+OP_CMP_EQ = 2
+OP_CMP_NE = 3
+OP_CMP_GT = 4
+OP_CMP_LT = 5
+OP_CMP_GE = 6
+OP_CMP_LE = 7
+OP_CONTAINS = 8
+OP_AND = 9
+OP_OR = 10
+OP_NOT = 11
+OP_JUMP_IF_FALSE = 12
+OP_JUMP_IF_TRUE = 13
+OP_CONTAINS_ANY = 14
 
-    def insert(self, collection: str, record: Dict[str, Any], record_id: Optional[str] = None) -> str:
-        """Insert a new record in the specified collection. If record_id is not provided, a new UUID is generated."""
-        if collection not in self.data:
-            self.data[collection] = {}
+_CMP_OPCODES = {
+    "==": OP_CMP_EQ,
+    "!=": OP_CMP_NE,
+    ">": OP_CMP_GT,
+    "<": OP_CMP_LT,
+    ">=": OP_CMP_GE,
+    "<=": OP_CMP_LE,
+    "contains": OP_CONTAINS,
+}
+_CMP_OPERATORS = {opcode: operator for operator, opcode in _CMP_OPCODES.items()}
 
-        if record_id is None:
-            record_id = self.create_record_id()
-        
-        self.data[collection][record_id] = record
-        self._save_db()
-        return record_id
+# Column types whose values _compare always orders numerically
+_NUMBER_TYPES = {int, float, bool}
+_ORDERINGS = {">": gt, "<": lt, ">=": ge, "<=": le}
 
-    def insert_many(self, collection: str, records: List[Dict[str, Any]], record_ids: Optional[List[str]] = None) -> List[str]:
-        """Insert multiple records in the specified collection. If record_ids are not provided, new UUIDs are generated."""
-        if collection not in self.data:
-            self.data[collection] = {}
+# Lexer for criteria expressions: quoted strings (kept whole, quotes included),
+# comparison operators, parentheses, and runs of any other non-space text.
+_TOKEN_RE = re.compile(r"'[^']*(?:'|$)|==|!=|>=|<=|>|<|[()]|[^\s()'=!<>]+|\S")
 
-        if record_ids is None:
-            generated_record_ids = [self.create_record_id() for _ in records]
-        else:
-            if len(record_ids) != len(records):
-                raise ValueError("Length of provided record_ids must match length of records.")
-            generated_record_ids = record_ids
+# Binding strength of the logical operators used by the shunting-yard pass.
+_PRECEDENCE = {"or": 1, "and": 2, "not": 3}
 
-        for i, record in enumerate(records):
-            self.data[collection][generated_record_ids[i]] = record
-        
-        self._save_db()
-        return generated_record_ids
 
-    def _parse_value(self, value: str) -> Any:
-        """Parse a value from string to appropriate type."""
-        value = value.strip()
-        if value.startswith("'") and value.endswith("'"):
-            return value[1:-1]  # String literal
+def _parse_value(value: str) -> Any:
+    """Parse a value from string to appropriate type."""
+    value = value.strip()
+    if value.startswith("'") and value.endswith("'"):
+        return value[1:-1]  # String literal
+    try:
+        return int(value)
+    except ValueError:
         try:
-            return int(value)
+            return float(value)
         except ValueError:
             try:
-                return float(value)
+                return datetime.fromisoformat(value)
             except ValueError:
-                try:
-                    return datetime.fromisoformat(value)
-                except ValueError:
-                    return value  # Fallback to string
-
-    def _get_nested_value(self, data: Dict[str, Any], key: str) -> Any:
-        """Retrieve a value from a nested dictionary using a dot-separated key."""
-        keys = key.split('.')
-        value = data
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
-            else:
-                return None  # Key not found
-        return value
+                return value  # Fallback to string
+
+
+_MISSING = object()
 
-    def _evaluate_condition(self, rec_data: Dict[str, Any], key: str, operator: str, value: Any) -> bool:
-        """Evaluate a single condition against a record."""
-        rec_value = self._get_nested_value(rec_data, key)
-        if rec_value is None:
-            return False
 
-        # Handle date comparisons
-        if operator in (">", "<", ">=", "<=", "==", "!=") and isinstance(value, datetime):
+def _get_nested_value(data: Dict[str, Any], key: str) -> Any:
+    """Retrieve a value from a nested dictionary using a dot-separated key."""
+    return _walk(data, key.split('.'))
+
+
+def _walk(data: Dict[str, Any], path: tuple) -> Any:
+    """Retrieve a value from a nested dictionary by a key already split into its parts."""
+    value = data
+    for k in path:
+        # The exact type check is a cheap fast path for the plain dicts JSON decodes to
+        if type(value) is not dict and not isinstance(value, dict):
+            return None
+        value = value.get(k, _MISSING)
+        if value is _MISSING:
+            return None  # Key not found
+    return value
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_iso_datetime(value: Any) -> Optional[datetime]:
+    """Parse a record value as an ISO 8601 datetime, or return None if it is not one.
+
+    Memoized by the raw value so a scan comparing a date field against a date
+    literal parses each distinct stored string only once.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _compare(rec_value: Any, operator: str, value: Any) -> bool:
+    """Evaluate a single condition against a value taken from a record."""
+    if rec_value is None:
+        return False
+
+    # Handle date comparisons
+    if operator in (">", "<", ">=", "<=", "==", "!=") and isinstance(value, datetime):
+        try:
+            rec_date = _parse_iso_datetime(rec_value)
+        except TypeError:
+            rec_date = None  # Unhashable record value, e.g. a list
+        if rec_date is not None:
             try:
-                rec_date = datetime.fromisoformat(rec_value)
                 if operator == ">":
                     return rec_date > value
                 elif operator == "<":
@@ -126,157 +214,1045 @@ class JsonDB:
             except (ValueError, TypeError):
                 pass  # Fall back to regular comparison
 
-        # Handle regular comparisons
+    # Handle regular comparisons
+    if operator == "==":
+        return rec_value == value
+    elif operator == "!=":
+        return rec_value != value
+    elif operator in (">", "<", ">=", "<="):
+        if not isinstance(rec_value, (int, float)):
+            return False
+        try:
+            if operator == ">":
+                return rec_value > value
+            elif operator == "<":
+                return rec_value < value
+            elif operator == ">=":
+                return rec_value >= value
+            else:
+                return rec_value <= value
+        except TypeError:
+            return False  # Number against a non-numeric literal
+    return False
+
+
+def _contains(rec_value: Any, needle: Any) -> bool:
+    """Case-insensitive substring test against a needle lowercased at compile time."""
+    return isinstance(rec_value, str) and isinstance(needle, str) and needle in rec_value.lower()
+
+
+def _contains_any(rec_value: Any, pattern: Pattern[str]) -> bool:
+    """Test whether any of the lowercased needles alternated in pattern occurs in the value."""
+    return isinstance(rec_value, str) and pattern.search(rec_value.lower()) is not None
+
+
+def _tokenize_expression(expression: str) -> List[str]:
+    """Tokenize the expression, preserving quoted strings, operators, and parentheses."""
+    return _TOKEN_RE.findall(expression)
+
+
+def _to_rpn(tokens: List[str]) -> List[Any]:
+    """Convert infix tokens to reverse Polish notation with the shunting-yard algorithm.
+
+    Conditions become ``(key, operator, value)`` tuples with the value already
+    parsed; logical operators are kept as their lowercase keyword.
+    """
+    output = []
+    stack = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        keyword = token.lower()
+        if token == "(":
+            stack.append(token)
+            i += 1
+        elif token == ")":
+            while stack and stack[-1] != "(":
+                output.append(stack.pop())
+            if stack:
+                stack.pop()
+            i += 1
+        elif keyword == "not":
+            stack.append(keyword)
+            i += 1
+        elif keyword in ("and", "or"):
+            while stack and stack[-1] != "(" and _PRECEDENCE[stack[-1]] >= _PRECEDENCE[keyword]:
+                output.append(stack.pop())
+            stack.append(keyword)
+            i += 1
+        elif i + 2 >= len(tokens):
+            # Incomplete condition (missing operator or value) never matches
+            output.append((token, None, None))
+            i = len(tokens)
+        else:
+            # Join remaining tokens for value (handles multi-word strings)
+            operator = tokens[i + 1]
+            i += 2
+            value_tokens = []
+            while i < len(tokens) and tokens[i].lower() not in ("and", "or", "not") and tokens[i] != ")":
+                value_tokens.append(tokens[i])
+                i += 1
+            output.append((token, operator, _parse_value(" ".join(value_tokens))))
+    while stack:
+        op = stack.pop()
+        if op != "(":
+            output.append(op)
+    return output
+
+
+def _build_tree(rpn: List[Any]) -> Optional[tuple]:
+    """Assemble RPN items into an expression tree, or None for an empty expression.
+
+    Nodes are ``("cond", key, operator, value)``, ``("const", bool)``,
+    ``("not", operand)`` and ``("and" | "or", left, right)``.
+    """
+    nodes = []
+    for item in rpn:
+        if isinstance(item, tuple):
+            key, operator, value = item
+            if operator in _CMP_OPCODES:
+                nodes.append(("cond", key, operator, value))
+            else:
+                nodes.append(("const", False))
+        elif item == "not":
+            if nodes:
+                nodes.append(("not", nodes.pop()))
+            else:
+                # A dangling "not" makes the whole expression false
+                nodes.append(("const", False))
+        elif len(nodes) >= 2:
+            right = nodes.pop()
+            nodes.append((item, nodes.pop(), right))
+    return nodes[0] if nodes else None
+
+
+def _emit(node: tuple, program: List[tuple]) -> None:
+    """Append the opcodes evaluating an expression tree node to a program."""
+    kind = node[0]
+    if kind == "cond":
+        program.append((OP_LOAD_FIELD, node[1], tuple(node[1].split('.'))))
+        if node[2] == "contains" and isinstance(node[3], str):
+            program.append((OP_CONST, node[3].lower()))
+        else:
+            program.append((OP_CONST, node[3]))
+        program.append((_CMP_OPCODES[node[2]],))
+    elif kind == "contains_any":
+        program.append((OP_LOAD_FIELD, node[1], tuple(node[1].split('.'))))
+        program.append((OP_CONST, node[2]))
+        program.append((OP_CONTAINS_ANY,))
+    elif kind == "const":
+        program.append((OP_CONST, node[1]))
+    elif kind == "not":
+        _emit(node[1], program)
+        program.append((OP_NOT,))
+    else:
+        # Once the left operand decides the result, jump past the right
+        # operand and the combining opcode, leaving the left value as the result.
+        _emit(node[1], program)
+        jump = len(program)
+        program.append(None)  # Patched below once the target is known
+        _emit(node[2], program)
+        program.append((OP_AND,) if kind == "and" else (OP_OR,))
+        program[jump] = (OP_JUMP_IF_FALSE if kind == "and" else OP_JUMP_IF_TRUE, len(program))
+
+
+def _disjuncts(node: tuple) -> List[tuple]:
+    """Flatten a chain of ``or`` nodes into its operands."""
+    if node[0] == "or":
+        return _disjuncts(node[1]) + _disjuncts(node[2])
+    return [node]
+
+
+def _merge_contains(node: Optional[tuple]) -> Optional[tuple]:
+    """Fold or-ed ``contains`` conditions on the same key into one regex search.
+
+    ``name contains 'a' or name contains 'b'`` becomes a single
+    ``("contains_any", key, pattern)`` node, so each value is lowercased and
+    scanned once for all needles instead of once per needle.
+    """
+    if node is None or node[0] in ("cond", "const"):
+        return node
+    if node[0] == "not":
+        return ("not", _merge_contains(node[1]))
+    if node[0] == "and":
+        return ("and", _merge_contains(node[1]), _merge_contains(node[2]))
+
+    operands = [_merge_contains(operand) for operand in _disjuncts(node)]
+    def is_needle(operand: tuple) -> bool:
+        return operand[0] == "cond" and operand[2] == "contains" and isinstance(operand[3], str)
+
+    needles = {}
+    for operand in operands:
+        if is_needle(operand):
+            needles.setdefault(operand[1], []).append(operand[3].lower())
+    merged = []
+    emitted = set()
+    for operand in operands:
+        key = operand[1]
+        if is_needle(operand) and len(needles[key]) > 1:
+            if key not in emitted:
+                emitted.add(key)
+                pattern = re.compile("|".join(map(re.escape, needles[key])))
+                merged.append(("contains_any", key, pattern))
+        else:
+            merged.append(operand)
+    return functools.reduce(lambda left, right: ("or", left, right), merged)
+
+
+def _conjuncts(node: Optional[tuple]) -> List[tuple]:
+    """Flatten the top-level chain of ``and`` nodes into its operands."""
+    if node is None:
+        return []
+    if node[0] == "and":
+        return _conjuncts(node[1]) + _conjuncts(node[2])
+    return [node]
+
+
+def _cost(node: tuple) -> int:
+    """Estimate how expensive a condition is to evaluate against one record."""
+    kind = node[0]
+    if kind == "const":
+        return 0
+    if kind == "contains_any":
+        return 5 + node[1].count('.')
+    if kind == "cond":
+        if node[2] == "contains":
+            cost = 4
+        elif node[2] in ("==", "!="):
+            cost = 1
+        else:
+            cost = 3 if isinstance(node[3], datetime) else 2
+        # Every extra level of a dotted key is another lookup
+        return cost + node[1].count('.')
+    if kind == "not":
+        return _cost(node[1])
+    return _cost(node[1]) + _cost(node[2])
+
+
+def _order_conjuncts(node: Optional[tuple]) -> Optional[tuple]:
+    """Reorder the operands of every ``and`` chain so the cheapest run first.
+
+    ``and`` short-circuits both in the per-row interpreter and in the
+    column scan, which only gathers the rows earlier operands left
+    undecided. Putting plain equality tests ahead of ordering comparisons,
+    ``contains`` and deeply nested keys therefore skips the expensive
+    conditions for every record an earlier one already rejects.
+    The sort is stable, so operands of equal cost keep their written order.
+    """
+    if node is None or node[0] in ("cond", "const", "contains_any"):
+        return node
+    if node[0] == "not":
+        return ("not", _order_conjuncts(node[1]))
+    if node[0] == "or":
+        return ("or", _order_conjuncts(node[1]), _order_conjuncts(node[2]))
+    operands = sorted((_order_conjuncts(operand) for operand in _conjuncts(node)), key=_cost)
+    return functools.reduce(lambda left, right: ("and", left, right), operands)
+
+
+def _broadcast(value: Any, size: int) -> List[Any]:
+    """Return value as a column, repeating a scalar result size times."""
+    return value if isinstance(value, list) else [value] * size
+
+
+def _compare_column(column: List[Any], operator: str, value: Any) -> List[bool]:
+    """Evaluate a condition against every value in a column, like _compare does for one.
+
+    When the column's types make the outcome of _compare's type checks
+    uniform, the comparison runs as a single C-level map over the column;
+    mixed columns fall back to comparing value by value.
+    """
+    if not isinstance(value, datetime):
         if operator == "==":
-            return rec_value == value
-        elif operator == "!=":
-            return rec_value != value
-        elif operator == ">":
-            return isinstance(rec_value, (int, float)) and rec_value > value
-        elif operator == "<":
-            return isinstance(rec_value, (int, float)) and rec_value < value
-        elif operator == ">=":
-            return isinstance(rec_value, (int, float)) and rec_value >= value
-        elif operator == "<=":
-            return isinstance(rec_value, (int, float)) and rec_value <= value
-        elif operator == "contains":
-            return isinstance(rec_value, str) and isinstance(value, str) and value.lower() in rec_value.lower()
-        return False
+            return list(map(eq, column, itertools.repeat(value)))
+        types = set(map(type, column))
+        if operator == "!=":
+            if type(None) not in types:
+                return list(map(ne, column, itertools.repeat(value)))
+        elif not isinstance(value, (int, float)):
+            return [False] * len(column)  # Only numbers are ordered, and never against non-numbers
+        elif types <= _NUMBER_TYPES:
+            return list(map(_ORDERINGS[operator], column, itertools.repeat(value)))
+    return [_compare(rec_value, operator, value) for rec_value in column]
+
+
+def _lowered_values(column: List[Any]) -> Tuple[Iterable[Optional[str]], bool]:
+    """Lazily lowercase the strings in a column, mapping every other value to None.
+
+    Also returns whether the column held anything other than strings.
+    """
+    if set(map(type, column)) <= {str}:
+        return map(str.lower, column), False
+    return (rec_value.lower() if isinstance(rec_value, str) else None for rec_value in column), True
+
 
-    def _tokenize_expression(self, expression: str) -> List[str]:
-        """Tokenize the expression, preserving quoted strings, operators, and parentheses."""
-        expression = re.sub(r'(\b(and|or|not)\b|==|!=|>=|<=|>|<|contains|\(|\))', r' \1 ', expression)
-        tokens = []
-        current_token = ""
-        in_quotes = False
-        for char in expression:
-            if char == "'":
-                in_quotes = not in_quotes
-                current_token += char
-            elif char.isspace() and not in_quotes:
-                if current_token:
-                    tokens.append(current_token)
-                    current_token = ""
+def _contains_column(lowered: Iterable[Optional[str]], mixed: bool, needle: Any, size: int) -> List[bool]:
+    """Evaluate _contains over values from _lowered_values."""
+    if not isinstance(needle, str):
+        return [False] * size
+    if not mixed:
+        return list(map(contains, lowered, itertools.repeat(needle)))
+    return [rec_value is not None and needle in rec_value for rec_value in lowered]
+
+
+def _contains_any_column(lowered: Iterable[Optional[str]], mixed: bool, pattern: Pattern[str], size: int) -> List[bool]:
+    """Evaluate _contains_any over values from _lowered_values."""
+    search = pattern.search
+    if not mixed:
+        return list(map(bool, map(search, lowered)))
+    return [rec_value is not None and search(rec_value) is not None for rec_value in lowered]
+
+
+def _scan_program(program: List[tuple], rows: List[Dict[str, Any]]) -> List[bool]:
+    """Execute a compiled criteria program column-wise, returning one result per row.
+
+    The jump opcodes narrow the rows later opcodes work on: once the left
+    operand of an ``and`` (``or``) is known, only the rows it left undecided
+    are gathered for the right operand, so its fields are loaded, compared
+    and lowercased for those rows alone. The combining opcode then merges
+    the right operand's results back into the left operand's column.
+    """
+    # Keys tested by more than one contains keep their lowercased column for
+    # reuse; every other contains lowercases values one at a time.
+    contains_keys = [program[pc - 2][1] for pc, instruction in enumerate(program)
+                     if instruction[0] in (OP_CONTAINS, OP_CONTAINS_ANY) and program[pc - 2][0] == OP_LOAD_FIELD]
+    shared_keys = {key for key in contains_keys if contains_keys.count(key) > 1}
+
+    size = len(rows)
+    columns = {}
+    lowered = {}  # id(column) -> (lowercased column, mixed), for keys in shared_keys
+    # One entry per pending and/or: None when every row is still undecided,
+    # otherwise the state to restore and where the narrowed rows came from.
+    frames = []
+    stack = []
+    pc = 0
+    end = len(program)
+    while pc < end:
+        instruction = program[pc]
+        opcode = instruction[0]
+        if opcode in (OP_JUMP_IF_FALSE, OP_JUMP_IF_TRUE):
+            left = _broadcast(stack[-1], size)
+            if opcode == OP_JUMP_IF_FALSE:
+                positions = list(itertools.compress(range(size), left))
+            else:
+                positions = list(itertools.compress(range(size), map(not_, left)))
+            if not positions:
+                # The left operand decides every row; it stays as the result
+                pc = instruction[1]
+                continue
+            if len(positions) == size:
+                frames.append(None)
+            else:
+                frames.append((rows, columns, lowered, left, positions))
+                rows = [rows[position] for position in positions]
+                size = len(rows)
+                columns = {}
+                lowered = {}
+        elif opcode in (OP_AND, OP_OR):
+            right = _broadcast(stack.pop(), size)
+            stack.pop()
+            frame = frames.pop()
+            if frame is None:
+                # Every row reached the right operand, which is therefore the result
+                stack.append(right)
             else:
-                current_token += char
-        if current_token:
-            tokens.append(current_token)
-        return [t.strip() for t in tokens if t.strip()]
-
-    def _parse_expression(self, tokens: List[str], rec_data: Dict[str, Any], index: int = 0) -> tuple[bool, int]:
-        """Recursively parse and evaluate the expression, handling parentheses."""
-        if index >= len(tokens):
-            return True, index
-
-        # Stack to manage sub-expressions
-        results = []
-        operators = []
-        i = index
-
-        while i < len(tokens):
-            token = tokens[i].lower()
-
-            if token == "(":
-                # Parse sub-expression within parentheses
-                sub_result, new_i = self._parse_expression(tokens, rec_data, i + 1)
-                results.append(sub_result)
-                i = new_i
-                if i < len(tokens) and tokens[i] == ")":
-                    i += 1
-            elif token == ")":
-                # End of sub-expression
-                break
-            elif token == "not":
-                # Handle not operator
-                if i + 1 < len(tokens):
-                    if tokens[i + 1] == "(":
-                        sub_result, new_i = self._parse_expression(tokens, rec_data, i + 2)
-                        results.append(not sub_result)
-                        i = new_i
-                        if i < len(tokens) and tokens[i] == ")":
-                            i += 1
-                    else:
-                        sub_result, new_i = self._parse_condition(tokens, rec_data, i + 1)
-                        results.append(not sub_result)
-                        i = new_i
+                rows, columns, lowered, left, positions = frame
+                size = len(rows)
+                result = list(left)
+                for position, value in zip(positions, right):
+                    result[position] = value
+                stack.append(result)
+        elif opcode == OP_LOAD_FIELD:
+            key = instruction[1]
+            column = columns.get(key)
+            if column is None:
+                if "." in key:
+                    path = instruction[2]
+                    column = [_walk(row, path) for row in rows]
                 else:
-                    return False, i + 1
-            elif token in ("and", "or"):
-                operators.append(token)
-                i += 1
+                    column = [row.get(key) for row in rows]
+                columns[key] = column
+            stack.append(column)
+        elif opcode == OP_CONST:
+            stack.append(instruction[1])
+        elif opcode == OP_NOT:
+            stack.append(list(map(not_, _broadcast(stack.pop(), size))))
+        elif opcode in (OP_CONTAINS, OP_CONTAINS_ANY):
+            needle = stack.pop()
+            column = stack.pop()
+            load = program[pc - 2]
+            if load[0] == OP_LOAD_FIELD and load[1] in shared_keys:
+                if id(column) not in lowered:
+                    values, mixed = _lowered_values(column)
+                    lowered[id(column)] = (list(values), mixed)
+                values, mixed = lowered[id(column)]
             else:
-                # Parse condition
-                condition_result, new_i = self._parse_condition(tokens, rec_data, i)
-                results.append(condition_result)
-                i = new_i
-
-            # Evaluate AND/OR if we have enough results
-            while len(results) >= 2 and operators:
-                op = operators.pop(0)
-                right = results.pop()
-                left = results.pop()
-                if op == "and":
-                    results.append(left and right)
-                elif op == "or":
-                    results.append(left or right)
-
-        # Final evaluation
-        result = results[0] if results else True
-        return result, i
-
-    def _parse_condition(self, tokens: List[str], rec_data: Dict[str, Any], index: int) -> tuple[bool, int]:
-        """Parse a single condition (key operator value)."""
-        if index + 2 >= len(tokens):
-            return False, index
-
-        key = tokens[index]
-        operator = tokens[index + 1]
-        # Join remaining tokens for value (handles multi-word strings)
-        i = index + 2
-        value_tokens = []
-        while i < len(tokens) and tokens[i] not in ("and", "or", "not", ")"):
-            value_tokens.append(tokens[i])
-            i += 1
-        value = self._parse_value(" ".join(value_tokens))
-        return self._evaluate_condition(rec_data, key, operator, value), i
+                values, mixed = _lowered_values(column)
+            if opcode == OP_CONTAINS:
+                stack.append(_contains_column(values, mixed, needle, size))
+            else:
+                stack.append(_contains_any_column(values, mixed, needle, size))
+        else:
+            value = stack.pop()
+            stack.append(_compare_column(stack.pop(), _CMP_OPERATORS[opcode], value))
+        pc += 1
+    return _broadcast(stack[0] if stack else True, size)
+
+
+class _Criteria:
+    """A compiled criteria expression, callable as a predicate over one record."""
+
+    def __init__(self, tree: Optional[tuple]):
+        self.program = []
+        if tree is not None:
+            _emit(_order_conjuncts(_merge_contains(tree)), self.program)
+        # (key, value) pairs that every matching record must satisfy with ==;
+        # read() probes these against hash indexes before scanning.
+        self.equalities = [
+            (node[1], node[3]) for node in _conjuncts(tree)
+            if node[0] == "cond" and node[2] == "==" and not isinstance(node[3], datetime)
+        ]
 
-    def read(self, collection: str, record_id: Optional[str] = None, criteria: Optional[str] = None) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
-        """Read records from a collection by ID, criteria expression, or all records."""
-        if collection not in self.data:
-            return {} if record_id else []
+    def __call__(self, rec_data: Dict[str, Any], stack: Optional[List[Any]] = None) -> bool:
+        return _run_program(self.program, rec_data, stack)
+
+    def scan(self, rows: List[Dict[str, Any]]) -> List[bool]:
+        """Evaluate the program a column at a time over many records.
+
+        Each field the program loads is gathered into one list of values
+        (a structure-of-arrays view of the rows) and every opcode then works
+        on whole columns, so the per-row interpreter overhead is paid once
+        per opcode instead of once per opcode per row.
+        """
+        return _scan_program(self.program, rows)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_criteria(expression: str) -> _Criteria:
+    """Compile a criteria expression into a predicate over a single record.
+
+    The expression is tokenized and parsed once; the resulting predicate runs
+    a flat opcode program against each record. Results are cached per
+    expression string so repeated queries skip parsing entirely.
+    """
+    return _Criteria(_build_tree(_to_rpn(_tokenize_expression(expression))))
+
+
+def _load_field(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+    path = instruction[2]
+    if len(path) == 1:
+        stack.append(rec_data.get(path[0]))
+    else:
+        stack.append(_walk(rec_data, path))
+
+
+def _load_const(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+    stack.append(instruction[1])
+
+
+def _and(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+    right = stack.pop()
+    stack.append(stack.pop() and right)
+
+
+def _or(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+    right = stack.pop()
+    stack.append(stack.pop() or right)
+
+
+def _not(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+    stack.append(not stack.pop())
+
+
+def _jump_if_false(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> Optional[int]:
+    if not stack[-1]:
+        return instruction[1]
+    return None
+
+
+def _jump_if_true(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> Optional[int]:
+    if stack[-1]:
+        return instruction[1]
+    return None
+
+
+def _cmp_contains(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+    needle = stack.pop()
+    stack.append(_contains(stack.pop(), needle))
+
+
+def _cmp_contains_any(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+    pattern = stack.pop()
+    stack.append(_contains_any(stack.pop(), pattern))
+
+
+def _make_cmp(operator: str) -> Callable[[List[Any], tuple, Dict[str, Any]], None]:
+    """Build the handler for a comparison opcode."""
+    def handler(stack: List[Any], instruction: tuple, rec_data: Dict[str, Any]) -> None:
+        value = stack.pop()
+        stack.append(_compare(stack.pop(), operator, value))
+    return handler
+
+
+# Dispatch table for the criteria VM: opcode -> handler(stack, instruction, rec_data).
+# Jump handlers return the index of the next instruction to run when they branch.
+OPS = {
+    OP_LOAD_FIELD: _load_field,
+    OP_CONST: _load_const,
+    OP_AND: _and,
+    OP_OR: _or,
+    OP_NOT: _not,
+    OP_JUMP_IF_FALSE: _jump_if_false,
+    OP_JUMP_IF_TRUE: _jump_if_true,
+    OP_CONTAINS: _cmp_contains,
+    OP_CONTAINS_ANY: _cmp_contains_any,
+}
+OPS.update((opcode, _make_cmp(operator)) for opcode, operator in _CMP_OPERATORS.items() if opcode not in OPS)
+
+
+def _run_program(program: List[tuple], rec_data: Dict[str, Any], stack: Optional[List[Any]] = None) -> bool:
+    """Execute a compiled criteria program against a record.
+
+    Callers evaluating many records may pass a scratch ``stack`` to reuse;
+    it is left empty on return.
+    """
+    if stack is None:
+        stack = []
+    ops = OPS
+    pc = 0
+    end = len(program)
+    while pc < end:
+        instruction = program[pc]
+        # Jump targets are always forward, so a falsy return means "fall through"
+        pc = ops[instruction[0]](stack, instruction, rec_data) or pc + 1
+    if not stack:
+        return True
+    result = stack[0]
+    stack.clear()
+    return result
+
+
+class Query:
+    """A criteria expression compiled once and bound to a database.
+
+    Returned by :meth:`JsonDB.compile`. Calling :meth:`filter` repeatedly
+    skips tokenizing and parsing, and row-by-row evaluation within a call
+    reuses one scratch stack instead of allocating a new one per record.
+    """
+
+    def __init__(self, db: "JsonDB", expression: str):
+        self.db = db
+        self.expression = expression
+        self._criteria = _compile_criteria(expression)
+
+    def filter(self, collection: str, stream: bool = False) -> Union[List[Dict[str, Any]], Iterator[Dict[str, Any]]]:
+        """Return the records in a collection that match this query, lazily if ``stream`` is set."""
+        if stream:
+            return self.db._iter_results(self.db._matches(collection, self._criteria))
+        with self.db._lock:
+            return [{"id": rec_id, **rec_data} for rec_id, rec_data in self.db._matches(collection, self._criteria)]
+
+    def __repr__(self) -> str:
+        return f"Query({self.expression!r})"
+
+
+def _synchronized(method: Callable) -> Callable:
+    """Run a JsonDB method while holding the database's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class JsonDB:
+    def __init__(self, filename: str, autocommit: bool = True, pretty: bool = False, eager: bool = False,
+                 flush_interval: Optional[float] = None):
+        self.filename = filename
+        self.autocommit = autocommit
+        self.pretty = pretty
+        self._data = None  # Parsed on first access unless eager; inserts do not need it
+        self._dirty = False
+        self._autocommit_stack = []
+        self._wal_path = filename + ".wal"
+        self._wal = None  # Opened for appending on the first logged mutation
+        self._wal_buf = bytearray()
+        # Sizes of the log (including buffered entries) and of the last snapshot
+        # loaded or written; taken from the files until the data is loaded.
+        self._wal_bytes = os.path.getsize(self._wal_path) if os.path.exists(self._wal_path) else 0
+        self._base_bytes = os.path.getsize(filename) if os.path.exists(filename) else 0
+        self._indexes = {}  # collection -> key -> value -> {record_id: None}
+        # Public methods hold this lock, so threads may share one instance
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher = None
+        self._flush_error = None
+        if eager:
+            self._load_db()
+        if flush_interval is not None:
+            self._flusher = threading.Thread(target=self._commit_periodically, args=(flush_interval,),
+                                             name=f"JsonDB flusher for {filename}", daemon=True)
+            self._flusher.start()
+
+    @property
+    def data(self) -> Dict[str, Dict[str, Any]]:
+        """All collections, loading the database file on first access."""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    # Inserts made before loading only exist in the log; hand any
+                    # still buffered to the file so replaying it picks them up.
+                    self.flush()
+                    self._load_db()
+                    self._compact_if_large()
+        return self._data
+
+    @data.setter
+    def data(self, value: Dict[str, Dict[str, Any]]) -> None:
+        self._data = value
+
+    @_synchronized
+    def __enter__(self) -> "JsonDB":
+        """Defer writes until the block exits, then commit them all at once."""
+        self._autocommit_stack.append(self.autocommit)
+        self.autocommit = False
+        return self
+
+    @_synchronized
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.autocommit = self._autocommit_stack.pop()
+        if self.autocommit:
+            self.commit()
+
+    def _load_db(self) -> None:
+        """Load data from JSON file (local or URL) if it exists, otherwise initialize empty data."""
+        if self.filename.startswith('http://') or self.filename.startswith('https://'):
+            try:
+                request = urllib.request.Request(self.filename, headers={'Accept-Encoding': 'gzip'})
+                with urllib.request.urlopen(request) as response:
+                    data = response.read()
+                    if response.headers.get('Content-Encoding') == 'gzip':
+                        data = gzip.decompress(data)
+                # Both parsers accept the raw bytes, so the body is never decoded to a str
+                self.data = _loads(data)
+                self._base_bytes = len(data)
+            except urllib.error.URLError as e:
+                raise IOError(f"Failed to fetch from URL: {e.reason}")
+            except json.JSONDecodeError:
+                raise ValueError("Failed to decode JSON from URL.")
+        elif os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'rb') as f:
+                    data = f.read()
+                self._base_bytes = len(data)
+                self.data = _loads(data) if data.strip() else {}
+            except json.JSONDecodeError as e:
+                # Starting empty instead would let the next save overwrite the file
+                raise ValueError(f"Failed to decode JSON from {self.filename}: {e}") from e
+        else:
+            self.data = {}
+            # A missing local file is created when the data is first loaded,
+            # which is on open only with eager=True.
+            self._save_db()
+        self._wal_bytes = 0
+        if os.path.exists(self._wal_path):
+            self._replay_wal()
+
+    def _replay_wal(self) -> None:
+        """Apply mutations logged since the last snapshot on top of the loaded data."""
+        with open(self._wal_path, 'rb+') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn write at the tail of the log; it was never
+                    # committed. Cut it off so new entries are not appended
+                    # behind it, where replay would never reach them.
+                    f.truncate(self._wal_bytes)
+                    break
+                try:
+                    entry = _loads(line)
+                except ValueError as e:
+                    # A complete entry that cannot be read may have committed
+                    # entries after it, so the log is left untouched.
+                    raise ValueError(
+                        f"Corrupt entry in write-ahead log {self._wal_path} at byte {self._wal_bytes}: {e}"
+                    ) from e
+                try:
+                    name, op, rec_id = entry["collection"], entry["op"], entry["id"]
+                    if op == "insert":
+                        self.data.setdefault(name, {})[rec_id] = entry["record"]
+                    elif name in self.data and rec_id in self.data[name]:
+                        if op == "update":
+                            self.data[name][rec_id].update(entry["record"])
+                        elif op == "delete":
+                            del self.data[name][rec_id]
+                            if not self.data[name]:
+                                del self.data[name]
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    # An entry that cannot be applied, such as an update to a
+                    # record that is not a dictionary, failed when it was first
+                    # made too; skipping it keeps the database loadable.
+                    pass
+                self._wal_bytes += len(line)
+
+    def _save_db(self) -> None:
+        """Save a full snapshot of the data to the JSON file, replacing it atomically."""
+        # Serialize up front so the file is written with a single call
+        payload = _dumps(self.data, indent=self.pretty)
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        # The snapshot is fully on disk before it replaces the old one, so a
+        # crash leaves either the old or the new file, never a truncated one.
+        os.replace(tmp_filename, self.filename)
+        # Sync the directory too, so the rename itself survives a crash.
+        # Directories cannot be opened this way on Windows.
+        if hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(os.path.dirname(self.filename) or '.', os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self._base_bytes = len(payload)
+
+    def _log(self, *entries: Dict[str, Any]) -> None:
+        """Buffer mutations for the write-ahead log.
+
+        Called before the data is modified: every entry is serialized first,
+        so a record that cannot be encoded raises without touching the data
+        or the buffer.
+        """
+        if not entries:
+            return  # An empty batch has nothing to commit
+        payload = b"".join(_dumps(entry) + b"\n" for entry in entries)
+        self._wal_buf += payload
+        self._wal_bytes += len(payload)
+        self._dirty = True
+
+    def _changed(self) -> None:
+        """Commit logged mutations unless writes are deferred."""
+        if self.autocommit:
+            self._commit()
+        elif len(self._wal_buf) >= _WAL_BUFFER_SIZE:
+            self.flush()
+
+    def _trim_wal(self) -> None:
+        """Cut off a partial entry a crash left at the end of the log.
+
+        Replay does this when the data is loaded; inserts made before that
+        call this instead, so they are not appended behind a torn entry
+        where replay would never reach them. Only the end of the file is read.
+        """
+        with open(self._wal_path, 'rb+') as f:
+            end = pos = f.seek(0, os.SEEK_END)
+            while pos > 0:
+                start = max(pos - 4096, 0)
+                f.seek(start)
+                newline = f.read(pos - start).rfind(b"\n")
+                if newline != -1:
+                    pos = start + newline + 1
+                    break
+                pos = start
+            if pos != end:
+                f.truncate(pos)
+
+    def _write_wal(self) -> None:
+        """Write buffered log entries to the write-ahead log in a single call."""
+        if self._wal is None:
+            if self._data is None and os.path.exists(self._wal_path):
+                self._trim_wal()
+            self._wal = open(self._wal_path, 'ab', buffering=0)
+        written = 0
+        try:
+            with memoryview(self._wal_buf) as view:
+                while written < len(view):
+                    with view[written:] as rest:
+                        written += self._wal.write(rest)
+        finally:
+            # Keep only what was not written so a retry does not log it twice
+            del self._wal_buf[:written]
+
+    @_synchronized
+    def flush(self) -> None:
+        """Write buffered changes to the write-ahead log without syncing it to disk.
+
+        The changes survive the process exiting, but only :meth:`commit`
+        guarantees they survive a crash of the machine.
+        """
+        if self._wal_buf:
+            self._write_wal()
+
+    @_synchronized
+    def commit(self) -> None:
+        """Write pending changes to the write-ahead log and sync it, compacting it once it grows large.
+
+        Raises the error of a failed background commit, if there was one since the last call.
+        """
+        self._raise_flush_error()
+        self._commit()
+
+    def _commit(self) -> None:
+        if self._dirty:
+            self.flush()
+            os.fsync(self._wal.fileno())
+            self._dirty = False
+        self._compact_if_large()
+
+    def _compact_if_large(self) -> None:
+        """Compact once the log outgrows the snapshot, whether or not the data is loaded yet.
+
+        Only sessions that have written to the log compact it, so one that only
+        reads never needs write access to the database file.
+        """
+        if self._wal is not None and self._wal_bytes > max(self._base_bytes, _WAL_COMPACT_MIN_BYTES):
+            self.compact()
+
+    @_synchronized
+    def compact(self) -> None:
+        """Write a full snapshot of the data and truncate the write-ahead log."""
+        if self._data is None:
+            # Loaded directly rather than through the data property, which
+            # could itself decide to compact.
+            self.flush()
+            self._load_db()
+        self._save_db()
+        self._wal_buf.clear()
+        if self._wal is not None:
+            self._wal.truncate(0)
+        elif os.path.exists(self._wal_path):
+            os.remove(self._wal_path)
+        self._wal_bytes = 0
+        self._dirty = False
+
+    def _commit_periodically(self, interval: float) -> None:
+        """Commit pending changes every interval seconds until the database is closed."""
+        while not self._closed.wait(interval):
+            try:
+                with self._lock:
+                    self._commit()
+            except Exception as error:
+                # Kept for the next commit() or close(); later intervals retry
+                self._flush_error = error
+
+    def _raise_flush_error(self) -> None:
+        error, self._flush_error = self._flush_error, None
+        if error is not None:
+            raise error
+
+    def close(self) -> None:
+        """Stop the background flusher, commit pending changes and close the write-ahead log."""
+        self._closed.set()
+        # Joined before taking the lock, which the flusher may be waiting on
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+            self._flusher = None
+        with self._lock:
+            try:
+                self._commit()
+            finally:
+                if self._wal is not None:
+                    self._wal.close()
+                    self._wal = None
+            self._raise_flush_error()
+
+    @_synchronized
+    def create_index(self, collection: str, key: str) -> None:
+        """Maintain a hash index on a (possibly dot-separated) key of a collection.
+
+        Criteria whose top level is an ``==`` comparison on an indexed key, or
+        an ``and`` of such comparisons, only evaluate the records the index
+        returns instead of scanning the whole collection. Matches then come
+        back in the order they were added to the index.
+        """
+        indexes = self._indexes.setdefault(collection, {})
+        indexes[key] = {}
+        for rec_id, rec_data in self.data.get(collection, {}).items():
+            value = _get_nested_value(rec_data, key)
+            if value is not None:
+                try:
+                    indexes[key].setdefault(value, {})[rec_id] = None
+                except TypeError:
+                    pass  # Unhashable values (lists, objects) never equal a literal
+
+    def _index_add(self, collection: str, rec_id: str, rec_data: Dict[str, Any]) -> None:
+        """Add a record to every index on its collection."""
+        for key, index in self._indexes.get(collection, {}).items():
+            value = _get_nested_value(rec_data, key)
+            if value is not None:
+                try:
+                    index.setdefault(value, {})[rec_id] = None
+                except TypeError:
+                    pass  # Unhashable values (lists, objects) never equal a literal
+
+    def _index_remove(self, collection: str, rec_id: str, rec_data: Dict[str, Any]) -> None:
+        """Remove a record from every index on its collection."""
+        for key, index in self._indexes.get(collection, {}).items():
+            value = _get_nested_value(rec_data, key)
+            try:
+                bucket = index.get(value)
+            except TypeError:
+                continue
+            if bucket is not None:
+                bucket.pop(rec_id, None)
+                if not bucket:
+                    del index[value]
+
+    def _index_candidates(self, collection: str, criteria: _Criteria) -> Optional[List[str]]:
+        """Return the IDs of records that may match criteria, or None if no index applies."""
+        indexes = self._indexes.get(collection)
+        if not indexes:
+            return None
+        buckets = [indexes[key].get(value, {}) for key, value in criteria.equalities if key in indexes]
+        if not buckets:
+            return None
+        buckets.sort(key=len)
+        smallest, others = buckets[0], buckets[1:]
+        return [rec_id for rec_id in smallest if all(rec_id in bucket for bucket in others)]
+
+    def create_record_id(self) -> str:
+        """Return a new record ID: 16 hex digits from a monotonic counter."""
+        return f"{next(_next_id):016x}"
+
+    def create_record_ids(self, n: int) -> List[str]:
+        """Return n new record IDs, as create_record_id would, in one call."""
+        return [f"{i:016x}" for i in itertools.islice(_next_id, n)]
+
+    @_synchronized
+    def insert(self, collection: str, record: Dict[str, Any], record_id: Optional[str] = None) -> str:
+        """Insert a new record in the specified collection. If record_id is not provided, a new ID is generated."""
+        if not isinstance(record, dict):
+            raise TypeError("Record must be a dictionary.")
+        if record_id is None:
+            record_id = self.create_record_id()
+        
+        self._log({"op": "insert", "collection": collection, "id": record_id, "record": record})
+        if self._data is not None:
+            stored = self._data.setdefault(collection, {})
+            if collection in self._indexes:
+                if record_id in stored:
+                    self._index_remove(collection, record_id, stored[record_id])
+                self._index_add(collection, record_id, record)
+            stored[record_id] = record
+        self._changed()
+        return record_id
+
+    @_synchronized
+    def insert_many(self, collection: str, records: List[Dict[str, Any]], record_ids: Optional[List[str]] = None) -> List[str]:
+        """Insert multiple records in the specified collection. If record_ids are not provided, new IDs are generated.
+
+        The batch is validated and logged before any record is stored, so an
+        invalid batch leaves the collection unchanged.
+        """
+        if record_ids is None:
+            generated_record_ids = self.create_record_ids(len(records))
+        else:
+            if len(record_ids) != len(records):
+                raise ValueError("Length of provided record_ids must match length of records.")
+            generated_record_ids = record_ids
+        if not all(isinstance(record, dict) for record in records):
+            raise TypeError("Records must be dictionaries.")
+
+        self._log(*({"op": "insert", "collection": collection, "id": record_id, "record": record}
+                    for record_id, record in zip(generated_record_ids, records)))
+        if self._data is not None and records:
+            stored = self._data.setdefault(collection, {})
+            if collection in self._indexes:
+                for record_id in set(generated_record_ids).intersection(stored):
+                    self._index_remove(collection, record_id, stored[record_id])
+            stored.update(zip(generated_record_ids, records))
+            if collection in self._indexes:
+                for record_id in dict.fromkeys(generated_record_ids):
+                    self._index_add(collection, record_id, stored[record_id])
+        
+        self._changed()
+        return generated_record_ids
+
+    @_synchronized
+    def read(self, collection: str, record_id: Optional[str] = None, criteria: Optional[str] = None,
+             stream: bool = False) -> Union[Dict[str, Any], List[Dict[str, Any]], Iterator[Dict[str, Any]]]:
+        """Read records from a collection by ID, criteria expression, or all records.
+
+        With ``stream`` set, records are returned as a generator that builds
+        each result only when it is consumed, so callers that stop early or
+        process one record at a time never hold the whole result list. The
+        matching records are chosen when read() is called; later changes to
+        the collection do not add or remove results.
+        """
+        records = self.data.get(collection)
+        if records is None:
+            if record_id:
+                return {}
+            return iter(()) if stream else []
 
         if record_id:
-            return self.data[collection].get(record_id, {})
+            return records.get(record_id, {})
 
         if criteria:
-            tokens = self._tokenize_expression(criteria)
-            results = []
-            for rec_id, rec_data in self.data[collection].items():
-                result, _ = self._parse_expression(tokens, rec_data)
-                if result:
-                    results.append({"id": rec_id, **rec_data})
-            return results
+            matches = self._matches(collection, _compile_criteria(criteria))
+        else:
+            matches = records.items()
+        if stream:
+            return self._iter_results(list(matches))
+        return [{"id": rec_id, **rec_data} for rec_id, rec_data in matches]
 
-        return [{"id": rec_id, **rec_data} for rec_id, rec_data in self.data[collection].items()]
+    def compile(self, expression: str) -> Query:
+        """Compile a criteria expression into a reusable :class:`Query`."""
+        return Query(self, expression)
 
+    @_synchronized
+    def _matches(self, collection: str, pred: _Criteria) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return the (record ID, record) pairs in a collection that satisfy a compiled predicate."""
+        records = self.data.get(collection)
+        if records is None:
+            return []
+        candidates = self._index_candidates(collection, pred)
+        if candidates is None:
+            rows = list(records.values())
+            return list(itertools.compress(zip(records, rows), pred.scan(rows)))
+        stack = []  # Scratch space shared by every row of this call
+        return [(rec_id, records[rec_id]) for rec_id in candidates if pred(records[rec_id], stack)]
+
+    def _iter_results(self, matches: Iterable[Tuple[str, Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+        """Yield read() results for already selected pairs, copying each record under the lock."""
+        for rec_id, rec_data in matches:
+            with self._lock:
+                result = {"id": rec_id, **rec_data}
+            yield result
+
+    @_synchronized
     def update(self, collection: str, record_id: str, updates: Dict[str, Any]) -> bool:
         """Update a specific record in the collection."""
         if collection in self.data and record_id in self.data[collection]:
-            self.data[collection][record_id].update(updates)
-            self._save_db()
+            # Normalized before logging: an entry that could not be applied
+            # here would also fail on every later replay of the log.
+            updates = dict(updates)
+            record = self.data[collection][record_id]
+            if not isinstance(record, dict):
+                raise TypeError(f"Record {record_id!r} is not a dictionary and cannot be updated.")
+            self._log({"op": "update", "collection": collection, "id": record_id, "record": updates})
+            self._index_remove(collection, record_id, record)
+            try:
+                record.update(updates)
+            finally:
+                self._index_add(collection, record_id, record)
+            self._changed()
             return True
         return False
 
+    @_synchronized
     def delete(self, collection: str, record_id: str) -> bool:
         """Delete a specific record from the collection."""
         if collection in self.data and record_id in self.data[collection]:
-            del self.data[collection][record_id]
+            self._log({"op": "delete", "collection": collection, "id": record_id})
+            record = self.data[collection].pop(record_id)
+            self._index_remove(collection, record_id, record)
             if not self.data[collection]:
                 del self.data[collection]
-            self._save_db()
+            self._changed()
             return True
         return False
 
+    @_synchronized
     def list_collections(self) -> List[str]:
         """List all collections in the database."""
         return list(self.data.keys())
@@ -285,8 +1261,9 @@ class JsonDB:
 if __name__ == "__main__":
     # Ensure a clean database for example usage
     db_file = "_data/database.json"
-    if os.path.exists(db_file):
-        os.remove(db_file)
+    for path in (db_file, db_file + ".wal"):
+        if os.path.exists(path):
+            os.remove(path)
 
     db = JsonDB(db_file)
 
@@ -294,13 +1271,15 @@ if __name__ == "__main__":
 
     # 1. Insert records with and without nested data
     print("\n1. Inserting various records:")
-    user1_id = db.insert("users", {"name": "Alice Smith", "age": 30, "city": "New York", "joined": "2025-09-01", "contact": {"email": "alice@example.com", "phone": "111-222-3333"}})
-    user2_id = db.insert("users", {"name": "Bob Johnson", "age": 25, "city": "Boston", "joined": "2025-08-15", "contact": {"email": "bob@example.com", "phone": "444-555-6666"}})
-    user3_id = db.insert("users", {"name": "Charlie Brown", "age": 35, "city": "New York", "joined": "2025-09-20", "address": {"street": "Main St", "zip": "10001"}})
-    user4_id = db.insert("users", {"name": "David Lee", "age": 28, "city": "Boston", "joined": "2025-07-10"})
-    
-    product1_id = db.insert("products", {"name": "Laptop", "specs": {"cpu": "i7", "ram_gb": 16}, "price": 1200})
-    product2_id = db.insert("products", {"name": "Mouse", "specs": {"type": "wireless"}, "price": 25})
+    # The with-block defers writing until it exits, so the file is saved once
+    with db:
+        user1_id = db.insert("users", {"name": "Alice Smith", "age": 30, "city": "New York", "joined": "2025-09-01", "contact": {"email": "alice@example.com", "phone": "111-222-3333"}})
+        user2_id = db.insert("users", {"name": "Bob Johnson", "age": 25, "city": "Boston", "joined": "2025-08-15", "contact": {"email": "bob@example.com", "phone": "444-555-6666"}})
+        user3_id = db.insert("users", {"name": "Charlie Brown", "age": 35, "city": "New York", "joined": "2025-09-20", "address": {"street": "Main St", "zip": "10001"}})
+        user4_id = db.insert("users", {"name": "David Lee", "age": 28, "city": "Boston", "joined": "2025-07-10"})
+
+        product1_id = db.insert("products", {"name": "Laptop", "specs": {"cpu": "i7", "ram_gb": 16}, "price": 1200})
+        product2_id = db.insert("products", {"name": "Mouse", "specs": {"type": "wireless"}, "price": 25})
     
     print(f"  Inserted user IDs: {user1_id}, {user2_id}, {user3_id}, {user4_id}")
     print(f"  Inserted product IDs: {product1_id}, {product2_id}")
@@ -386,6 +1365,8 @@ if __name__ == "__main__":
     print("\n--- All example operations completed! ---")
 
     # Clean up the dummy database
-    if os.path.exists(db_file):
-        os.remove(db_file)
+    db.close()
+    for path in (db_file, db_file + ".wal"):
+        if os.path.exists(path):
+            os.remove(path)
 
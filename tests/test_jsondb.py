@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from jsondb.jsondb import JsonDB
+
+
+class JsonDBTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "db.json")
+        self.wal_path = self.filename + ".wal"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def open(self, **kwargs):
+        db = JsonDB(self.filename, **kwargs)
+        self.addCleanup(db.close)
+        return db
+
+
+class TestWriteAheadLog(JsonDBTestCase):
+    def test_reopen_replays_log(self):
+        db = self.open()
+        alice = db.insert("users", {"name": "Alice", "age": 30})
+        bob = db.insert("users", {"name": "Bob", "age": 25})
+        db.update("users", alice, {"age": 31})
+        db.delete("users", bob)
+        db.close()
+
+        self.assertGreater(os.path.getsize(self.wal_path), 0)
+        db = self.open()
+        self.assertEqual(db.read("users"), [{"id": alice, "name": "Alice", "age": 31}])
+
+    def test_deferred_writes_survive_close(self):
+        db = self.open(autocommit=False)
+        with db:
+            ids = db.insert_many("users", [{"n": i} for i in range(3)])
+        db.close()
+
+        self.assertEqual([r["id"] for r in self.open().read("users")], ids)
+
+    def test_compact_folds_log_into_file(self):
+        db = self.open()
+        record_id = db.insert("users", {"name": "Alice"})
+        db.compact()
+        self.assertEqual(os.path.getsize(self.wal_path), 0)
+        db.close()
+
+        with open(self.filename) as f:
+            self.assertIn(record_id, f.read())
+        self.assertEqual(self.open().read("users", record_id), {"name": "Alice"})
+
+    def test_truncated_log_tail_is_dropped(self):
+        db = self.open()
+        kept = db.insert("users", {"name": "Alice"})
+        db.close()
+        with open(self.wal_path, "ab") as f:
+            f.write(b'{"op": "insert", "collection": "users", "id": "x", "rec')
+
+        db = self.open()
+        self.assertEqual([r["id"] for r in db.read("users")], [kept])
+        added = db.insert("users", {"name": "Bob"})
+        db.close()
+        self.assertEqual([r["id"] for r in self.open().read("users")], [kept, added])
+
+    def test_corrupt_complete_entry_raises(self):
+        self.open().insert("users", {"name": "Alice"})
+        with open(self.wal_path, "ab") as f:
+            f.write(b"not json\n")
+
+        with self.assertRaises(ValueError):
+            self.open().read("users")
+
+
+class TestIndexes(JsonDBTestCase):
+    def test_index_follows_update_and_delete(self):
+        db = self.open()
+        db.create_index("users", "city")
+        alice = db.insert("users", {"name": "Alice", "city": "Boston"})
+        bob = db.insert("users", {"name": "Bob", "city": "Boston"})
+
+        db.update("users", alice, {"city": "Paris"})
+        self.assertEqual([r["id"] for r in db.read("users", criteria="city == 'Boston'")], [bob])
+        self.assertEqual([r["id"] for r in db.read("users", criteria="city == 'Paris'")], [alice])
+
+        db.delete("users", bob)
+        self.assertEqual(db.read("users", criteria="city == 'Boston'"), [])
+
+    def test_nested_key_index(self):
+        db = self.open()
+        record_id = db.insert("users", {"contact": {"city": "Boston"}})
+        db.create_index("users", "contact.city")
+
+        self.assertEqual([r["id"] for r in db.read("users", criteria="contact.city == 'Boston'")], [record_id])
+
+
+class TestQuerying(JsonDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = self.open()
+        self.ids = self.db.insert_many("users", [
+            {"name": "Alice Smith", "age": 31, "city": "New York"},
+            {"name": "Bob", "age": 22, "city": "Boston"},
+            {"name": "Carol Smith", "age": 40, "city": "Boston"},
+        ])
+
+    def test_criteria(self):
+        results = self.db.read("users", criteria="age > 25 and name contains 'smith'")
+        self.assertEqual([r["id"] for r in results], [self.ids[0], self.ids[2]])
+
+    def test_stream(self):
+        results = self.db.read("users", criteria="city == 'Boston'", stream=True)
+        self.assertNotIsInstance(results, list)
+        self.assertEqual(next(results)["id"], self.ids[1])
+        self.assertEqual([r["id"] for r in results], [self.ids[2]])
+        self.assertEqual(list(self.db.read("missing", stream=True)), [])
+
+    def test_compiled_query(self):
+        query = self.db.compile("city == 'Boston' or age > 30")
+        self.assertEqual([r["id"] for r in query.filter("users")], self.ids)
+
+        self.db.update("users", self.ids[1], {"city": "Paris"})
+        self.assertEqual([r["id"] for r in query.filter("users", stream=True)], [self.ids[0], self.ids[2]])
+
+
+if __name__ == "__main__":
+    unittest.main()